@@ -1,14 +1,51 @@
+import asyncio
 import datetime
 import logging.config
 from environs import Env
 from seller import download_stock
 
+import numpy as np
+import orjson
+import pandas as pd
 import requests
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 from seller import divide, price_conversion
 
 logger = logging.getLogger(__file__)
 
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _is_retryable(error):
+    """Повторять запрос только после rate-limit и серверных ошибок."""
+    return (
+        isinstance(error, requests.HTTPError)
+        and error.response is not None
+        and error.response.status_code in _RETRYABLE_STATUSES
+    )
+
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+
+def _wait_retry_after(retry_state):
+    """Ждать, сколько просит сервер в Retry-After, иначе — backoff с джиттером."""
+    error = retry_state.outcome.exception()
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        retry_after = error.response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return _backoff(retry_state)
+
 
 def get_product_list(page, campaign_id, access_token):
     """
@@ -49,8 +86,14 @@ def get_product_list(page, campaign_id, access_token):
     return response_object.get("result")
 
 
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
 def update_stocks(stocks, campaign_id, access_token):
-     """
+    """
     Обновить остатки товаров на складе Яндекс.Маркет.
 
     Args:
@@ -77,12 +120,18 @@ def update_stocks(stocks, campaign_id, access_token):
     }
     payload = {"skus": stocks}
     url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
+    response = requests.put(url, headers=headers, data=orjson.dumps(payload))
     response.raise_for_status()
     response_object = response.json()
     return response_object
 
 
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
 def update_price(prices, campaign_id, access_token):
     """
     Обновить цены товаров на Яндекс.Маркет.
@@ -111,7 +160,7 @@ def update_price(prices, campaign_id, access_token):
     }
     payload = {"offers": prices}
     url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
+    response = requests.post(url, headers=headers, data=orjson.dumps(payload))
     response.raise_for_status()
     response_object = response.json()
     return response_object
@@ -138,16 +187,16 @@ def get_offer_ids(campaign_id, market_token):
         requests.exceptions.RequestException
     """
     page = ""
-    product_list = []
+    offer_ids = []
     while True:
         some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
+        offer_ids.extend(
+            product.get("offer").get("shopSku")
+            for product in some_prod.get("offerMappingEntries")
+        )
         page = some_prod.get("paging").get("nextPageToken")
         if not page:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
     return offer_ids
 
 
@@ -156,48 +205,59 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
     Создание данных для обновления остатков на складе Яндекс.Маркет.
 
     Args:
-        watch_remnants (list): Список словарей с данными о товарах от поставщика.
+        watch_remnants (pandas.DataFrame): Таблица с данными о товарах от поставщика.
         offer_ids (list): Список SKU товаров, доступных в кампании.
         warehouse_id (int): ID склада на Яндекс.Маркет.
 
     Returns:
-        list: Список словарей с количеством и SKU для обновления остатков.
+        tuple: (stocks, not_empty) — полный список словарей с количеством
+        и SKU и его подмножество с ненулевыми остатками.
 
     Example:
-        >>> create_stocks([{'Код': '001', 'Количество': '5'}], ['001'], 10)
-        [{'sku': '001', 'warehouseId': 10, 'items': [{'count': 5, 'type': 'FIT', 'updatedAt': '2025-12-23T12:00:00Z'}]}]
+        >>> create_stocks(pd.DataFrame([{'Код': '001', 'Количество': '5'}]), ['001'], 10)
+        ([{'sku': '001', 'warehouseId': 10, 'items': [{'count': 5, 'type': 'FIT', 'updatedAt': '2025-12-23T12:00:00Z'}]}], [...])
 
-        >>> create_stocks([], [], 10)
-        []
+        >>> create_stocks(pd.DataFrame(), [], 10)
+        ([], [])
     """
     # Уберем то, что не загружено в market
-    stocks = list()
     date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
+    remaining = set(offer_ids)
+    if not remaining:
+        return [], []
+    codes = watch_remnants["Код"].astype(str)
+    mask = codes.isin(remaining)
+    codes = codes[mask]
+    count = watch_remnants.loc[mask, "Количество"].astype(str)
+    stock = np.where(
+        count == ">10",
+        100,
+        np.where(
+            count == "1",
+            0,
+            pd.to_numeric(count, errors="coerce").fillna(0),
+        ),
+    ).astype(int)
+    stocks = []
+    not_empty = []
+    for code, number in zip(codes, stock):
+        entry = {
+            "sku": code,
+            "warehouseId": warehouse_id,
+            "items": [
                 {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
+                    "count": int(number),
+                    "type": "FIT",
+                    "updatedAt": date,
                 }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+            ],
+        }
+        stocks.append(entry)
+        if number:
+            not_empty.append(entry)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
+    remaining.difference_update(codes)
+    for offer_id in remaining:
         stocks.append(
             {
                 "sku": offer_id,
@@ -211,97 +271,94 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
                 ],
             }
         )
-    return stocks
+    return stocks, not_empty
 
 
 def create_prices(watch_remnants, offer_ids):
-        """
+    """
     Создание данных для обновления цен товаров на Яндекс.Маркет.
 
     Args:
-        watch_remnants (list): Список словарей с данными о товарах от поставщика.
+        watch_remnants (pandas.DataFrame): Таблица с данными о товарах от поставщика.
         offer_ids (list): Список SKU товаров, доступных в кампании.
 
     Returns:
         list: Список словарей с ID товара и ценой.
 
     Example:
-        >>> create_prices([{'Код': '001', 'Цена': "5'990.00 руб."}], ['001'])
+        >>> create_prices(pd.DataFrame([{'Код': '001', 'Цена': "5'990.00 руб."}]), ['001'])
         [{'id': '001', 'price': {'value': 5990, 'currencyId': 'RUR'}}]
 
-        >>> create_prices([], [])
+        >>> create_prices(pd.DataFrame(), [])
         []
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    offer_ids = set(offer_ids)
+    if not offer_ids:
+        return []
+    codes = watch_remnants["Код"].astype(str)
+    mask = codes.isin(offer_ids)
+    converted = watch_remnants.loc[mask, "Цена"].map(price_conversion)
+    prices = [
+        {
+            "id": code,
+            "price": {
+                "value": int(price),
+                "currencyId": "RUR",
+            },
+        }
+        for code, price in zip(codes[mask], converted)
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
-        """
+async def upload_prices(watch_remnants, campaign_id, market_token, offer_ids):
+    """
     Загрузить цены товаров на Яндекс.Маркет.
 
     Args:
-        watch_remnants (list): Список словарей с данными о товарах.
+        watch_remnants (pandas.DataFrame): Таблица с данными о товарах.
         campaign_id (str): ID кампании магазина.
         market_token (str): Токен доступа к API.
+        offer_ids (list): Список SKU товаров кампании.
 
     Returns:
         list: Список загруженных цен.
 
     Example:
-        >>> await upload_prices([{'Код': '001', 'Цена': "5'990.00 руб."}], "12345", "token")
+        >>> await upload_prices(watch_remnants, "12345", "token", ['001'])
         [{'id': '001', 'price': {'value': 5990, 'currencyId': 'RUR'}}]
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
+    for some_prices in divide(prices, 500):
         update_price(some_prices, campaign_id, market_token)
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id, offer_ids):
     """
     Загрузить остатки товаров на Яндекс.Маркет.
 
     Args:
-        watch_remnants (list): Список словарей с данными о товарах.
+        watch_remnants (pandas.DataFrame): Таблица с данными о товарах.
         campaign_id (str): ID кампании магазина.
         market_token (str): Токен доступа к API.
         warehouse_id (int): ID склада на Яндекс.Маркет.
+        offer_ids (list): Список SKU товаров кампании.
 
     Returns:
         tuple: (not_empty, stocks) — список товаров с ненулевыми остатками и полный список.
 
     Example:
-        >>> await upload_stocks([{'Код': '001', 'Количество': '5'}], "12345", "token", 10)
+        >>> await upload_stocks(watch_remnants, "12345", "token", 10, ['001'])
         ([{'sku': '001', 'warehouseId': 10, 'items': [{'count': 5, 'type': 'FIT'}]}], [...])
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
+    stocks, not_empty = create_stocks(watch_remnants, offer_ids, warehouse_id)
+    for some_stock in divide(stocks, 2000):
         update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
-    )
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     market_token = env.str("MARKET_TOKEN")
     campaign_fbs_id = env.str("FBS_ID")
@@ -314,20 +371,20 @@ def main():
         # FBS
         offer_ids = get_offer_ids(campaign_fbs_id, market_token)
         # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
+        await upload_stocks(
+            watch_remnants, campaign_fbs_id, market_token, warehouse_fbs_id, offer_ids
+        )
         # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
+        await upload_prices(watch_remnants, campaign_fbs_id, market_token, offer_ids)
 
         # DBS
         offer_ids = get_offer_ids(campaign_dbs_id, market_token)
         # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
+        await upload_stocks(
+            watch_remnants, campaign_dbs_id, market_token, warehouse_dbs_id, offer_ids
+        )
         # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
+        await upload_prices(watch_remnants, campaign_dbs_id, market_token, offer_ids)
     except requests.exceptions.ReadTimeout:
         print("Превышено время ожидания...")
     except requests.exceptions.ConnectionError as error:
@@ -337,4 +394,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,17 +1,80 @@
+import asyncio
+import hashlib
 import io
+import itertools
 import logging.config
-import os
-import re
 import zipfile
 from environs import Env
+from pathlib import Path
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
 import requests
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 logger = logging.getLogger(__file__)
 
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
 
-def get_product_list(last_id, client_id, seller_token):
+
+def _is_retryable(error):
+    """Повторять запрос только после rate-limit и серверных ошибок."""
+    return (
+        isinstance(error, httpx.HTTPStatusError)
+        and error.response.status_code in _RETRYABLE_STATUSES
+    )
+
+
+_backoff = wait_exponential_jitter(initial=1, max=30)
+
+
+def _wait_retry_after(retry_state):
+    """Ждать, сколько просит сервер в Retry-After, иначе — backoff с джиттером."""
+    error = retry_state.outcome.exception()
+    if isinstance(error, httpx.HTTPStatusError):
+        retry_after = error.response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return _backoff(retry_state)
+
+
+# Таблица удаления для str.translate со всеми не-цифрами из ASCII.
+# Не-ASCII символы ("руб", "₽", неразрывные пробелы) добираются
+# посимвольным фильтром в price_conversion.
+_NON_DIGITS = str.maketrans(
+    "",
+    "",
+    "".join(chr(code) for code in range(128) if not chr(code).isdigit()),
+)
+
+_CACHE_DIR = Path(".cache")
+
+# Неизменяемая часть записи о цене; per-row поля добавляются через **-слияние
+PRICE_TEMPLATE = {
+    "auto_action_enabled": "UNKNOWN",
+    "currency_code": "RUB",
+    "old_price": "0",
+}
+
+# Все эндпоинты Ozon живут на одном хосте: один клиент с HTTP/2
+# мультиплексирует параллельные запросы по единственному TLS-соединению.
+_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20),
+)
+
+
+async def get_product_list(last_id, client_id, seller_token):
     """Получает список товаров магазина Ozon.
 
     Args:
@@ -23,10 +86,10 @@ def get_product_list(last_id, client_id, seller_token):
         dict: Словарь с информацией о товарах.
 
     Examples:
-        >>> get_product_list("", "123", "token")
+        >>> await get_product_list("", "123", "token")
         {'items': [...], 'total': 10, 'last_id': 'abc'}
 
-        >>> get_product_list(None, "123", "token")
+        >>> await get_product_list(None, "123", "token")
         Traceback (TypeError)
     """
     url = "https://api-seller.ozon.ru/v2/product/list"
@@ -41,13 +104,13 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = await _client.post(url, json=payload, headers=headers)
     response.raise_for_status()
     response_object = response.json()
     return response_object.get("result")
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids(client_id, seller_token):
     """Возвращает список артикулов товаров магазина.
 
     Args:
@@ -58,28 +121,33 @@ def get_offer_ids(client_id, seller_token):
         list: Список строк с offer_id каждого товара.
 
     Examples:
-        >>> get_offer_ids("123", "token")
+        >>> await get_offer_ids("123", "token")
         ['offer1', 'offer2']
 
-        >>> get_offer_ids("", "")
-        Traceback (requests.exceptions.HTTPError)
+        >>> await get_offer_ids("", "")
+        Traceback (httpx.HTTPStatusError)
     """
     last_id = ""
-    product_list = []
+    offer_ids = []
     while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
+        some_prod = await get_product_list(last_id, client_id, seller_token)
+        offer_ids.extend(
+            product.get("offer_id") for product in some_prod.get("items")
+        )
         total = some_prod.get("total")
         last_id = some_prod.get("last_id")
-        if total == len(product_list):
+        if total == len(offer_ids):
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+async def update_price(prices: list, client_id, seller_token):
     """Обновляет цены товаров на Ozon.
 
     Args:
@@ -91,11 +159,11 @@ def update_price(prices: list, client_id, seller_token):
         dict: Ответ API с результатами обновления.
 
     Examples:
-        >>> update_price([{'offer_id': '123', 'price': '5990'}], "123", "token")
+        >>> await update_price([{'offer_id': '123', 'price': '5990'}], "123", "token")
         {'updated': 1}
 
-        >>> update_price([], "123", "token")
-        Traceback (requests.exceptions.HTTPError)
+        >>> await update_price([], "123", "token")
+        Traceback (httpx.HTTPStatusError)
     """
     url = "https://api-seller.ozon.ru/v1/product/import/prices"
     headers = {
@@ -103,12 +171,22 @@ def update_price(prices: list, client_id, seller_token):
         "Api-Key": seller_token,
     }
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
+    response = await _client.post(
+        url,
+        content=orjson.dumps(payload),
+        headers={**headers, "Content-Type": "application/json"},
+    )
     response.raise_for_status()
     return response.json()
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+async def update_stocks(stocks: list, client_id, seller_token):
     """Обновляет остатки товаров на Ozon.
 
     Args:
@@ -120,11 +198,11 @@ def update_stocks(stocks: list, client_id, seller_token):
         dict: Ответ API с результатами обновления.
 
     Examples:
-        >>> update_stocks([{'offer_id': '123', 'stock': 10}], "123", "token")
+        >>> await update_stocks([{'offer_id': '123', 'stock': 10}], "123", "token")
         {'updated': 1}
 
-        >>> update_stocks([], "123", "token")
-        Traceback (requests.exceptions.HTTPError)
+        >>> await update_stocks([], "123", "token")
+        Traceback (httpx.HTTPStatusError)
     """
     url = "https://api-seller.ozon.ru/v1/product/import/stocks"
     headers = {
@@ -132,75 +210,120 @@ def update_stocks(stocks: list, client_id, seller_token):
         "Api-Key": seller_token,
     }
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
+    response = await _client.post(
+        url,
+        content=orjson.dumps(payload),
+        headers={**headers, "Content-Type": "application/json"},
+    )
     response.raise_for_status()
     return response.json()
 
 
 def download_stock():
-    """Скачивает файл с остатками часов Casio и возвращает их как список.
+    """Скачивает файл с остатками часов Casio и возвращает их как таблицу.
+
+    Результат кэшируется на диске по заголовкам ETag/Last-Modified:
+    пока файл у поставщика не изменился, повторный вызов обходится одним
+    HEAD-запросом и чтением parquet из каталога .cache.
 
     Returns:
-        list: Список словарей с информацией о каждом часе.
+        pandas.DataFrame: Таблица с колонками "Код", "Количество", "Цена".
 
     Examples:
         >>> download_stock()
-        [{'Код': '123', 'Количество': '5', 'Цена': "5'990.00 руб."}]
+           Код Количество           Цена
+        0  123          5  5'990.00 руб.
 
         >>> download_stock()
         Traceback (requests.exceptions.ConnectionError)
     """
-    # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
     session = requests.Session()
-    response = session.get(casio_url)
-    response.raise_for_status()
-    with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
+    # Проверить кэш, чтобы не скачивать неизменившийся файл повторно
+    head = session.head(casio_url)
+    validators = head.headers.get("ETag", "") + head.headers.get("Last-Modified", "")
+    cache_file = None
+    if head.ok and validators:
+        key = hashlib.md5(validators.encode()).hexdigest()
+        cache_file = _CACHE_DIR / f"ostatki-{key}.parquet"
+        if cache_file.exists():
+            return pd.read_parquet(cache_file)
+    # Скачать остатки с сайта
+    buffer = io.BytesIO()
+    with session.get(casio_url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(1 << 16):
+            buffer.write(chunk)
+    buffer.seek(0)
+    with zipfile.ZipFile(buffer) as archive:
+        xls_bytes = archive.read("ostatki.xls")
+    # Создаем таблицу остатков часов:
     watch_remnants = pd.read_excel(
-        io=excel_file,
+        io=io.BytesIO(xls_bytes),
+        engine="calamine",
         na_values=None,
         keep_default_na=False,
         header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+    )
+    if cache_file is not None:
+        # Кэш — только оптимизация: неудачная запись (например, ArrowInvalid
+        # на колонках со смешанными типами) не должна ронять выгрузку
+        try:
+            _CACHE_DIR.mkdir(exist_ok=True)
+            watch_remnants.to_parquet(cache_file)
+        except Exception as error:
+            logger.warning("Не удалось записать кэш %s: %s", cache_file, error)
+        else:
+            # Убрать кэши устаревших версий файла, чтобы они не копились
+            for stale in _CACHE_DIR.glob("ostatki-*.parquet"):
+                if stale != cache_file:
+                    stale.unlink()
     return watch_remnants
 
 
 def create_stocks(watch_remnants, offer_ids):
     # Уберем то, что не загружено в seller
+    remaining = set(offer_ids)
+    if not remaining:
+        return [], []
+    codes = watch_remnants["Код"].astype(str)
+    mask = codes.isin(remaining)
+    codes = codes[mask]
+    count = watch_remnants.loc[mask, "Количество"].astype(str)
+    stock = np.where(
+        count == ">10",
+        100,
+        np.where(
+            count == "1",
+            0,
+            pd.to_numeric(count, errors="coerce").fillna(0),
+        ),
+    ).astype(int)
     stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    not_empty = []
+    for code, number in zip(codes, stock):
+        entry = {"offer_id": code, "stock": int(number)}
+        stocks.append(entry)
+        if number:
+            not_empty.append(entry)
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
+    remaining.difference_update(codes)
+    for offer_id in remaining:
         stocks.append({"offer_id": offer_id, "stock": 0})
-    return stocks
+    return stocks, not_empty
 
 
 def create_prices(watch_remnants, offer_ids):
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    offer_ids = set(offer_ids)
+    if not offer_ids:
+        return []
+    codes = watch_remnants["Код"].astype(str)
+    mask = codes.isin(offer_ids)
+    converted = watch_remnants.loc[mask, "Цена"].map(price_conversion)
+    prices = [
+        {**PRICE_TEMPLATE, "offer_id": code, "price": price}
+        for code, price in zip(codes[mask], converted)
+    ]
     return prices
 
 
@@ -230,7 +353,10 @@ def price_conversion(price: str) -> str:
             >>> price_conversion(5990)
             Traceback (AttributeError)
     """
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    value = price.split(".", 1)[0].translate(_NON_DIGITS)
+    if not value.isascii():
+        value = "".join(char for char in value if "0" <= char <= "9")
+    return value
 
 
 def divide(lst: list, n: int):
@@ -248,51 +374,65 @@ def divide(lst: list, n: int):
         [[1,2],[3,4]]
 
         >>> list(divide([], 2))
-        [[]]
+        []
     """
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+    iterator = iter(lst)
+    while chunk := list(itertools.islice(iterator, n)):
+        yield chunk
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
-    offer_ids = get_offer_ids(client_id, seller_token)
+async def upload_prices(watch_remnants, client_id, seller_token, offer_ids):
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    sem = asyncio.Semaphore(8)
+
+    async def send_chunk(some_price):
+        async with sem:
+            return await update_price(some_price, client_id, seller_token)
+
+    await asyncio.gather(
+        *(send_chunk(some_price) for some_price in divide(prices, 1000))
+    )
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
+async def upload_stocks(watch_remnants, client_id, seller_token, offer_ids):
+    stocks, not_empty = create_stocks(watch_remnants, offer_ids)
+    sem = asyncio.Semaphore(8)
+
+    async def send_chunk(some_stock):
+        async with sem:
+            return await update_stocks(some_stock, client_id, seller_token)
+
+    await asyncio.gather(
+        *(send_chunk(some_stock) for some_stock in divide(stocks, 100))
+    )
     return not_empty, stocks
 
 
-def main():
+async def main():
     env = Env()
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
+        offer_ids = await get_offer_ids(client_id, seller_token)
         watch_remnants = download_stock()
         # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
+        await upload_stocks(watch_remnants, client_id, seller_token, offer_ids)
         # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        await upload_prices(watch_remnants, client_id, seller_token, offer_ids)
+    except (requests.exceptions.ReadTimeout, httpx.TimeoutException):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
+    except (
+        requests.exceptions.ConnectionError,
+        httpx.ConnectError,
+    ) as error:
         print(error, "Ошибка соединения")
     except Exception as error:
         print(error, "ERROR_2")
+    finally:
+        if not _client.is_closed:
+            await _client.aclose()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())